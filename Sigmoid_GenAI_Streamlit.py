@@ -5,6 +5,10 @@ import seaborn as sns
 import re
 import json
 import time
+import hashlib
+import threading
+from collections import OrderedDict
+from pandas.tseries.api import guess_datetime_format
 from io import StringIO, BytesIO
 import requests
 from PIL import Image
@@ -48,8 +52,9 @@ if 'current_data_source' not in st.session_state:
 def reset_app_state():
     """Reset the app state when data source changes"""
     st.session_state.initialized = False
-    if 'df' in st.session_state:
-        del st.session_state.df
+    for key in ('df', 'upload_file_id', 'upload_prompt', 'upload_error', 'upload_coerced'):
+        if key in st.session_state:
+            del st.session_state[key]
         
 def save_figure_to_image(fig):
     """Convert matplotlib figure to bytes for Word document."""
@@ -233,21 +238,24 @@ def analyze_data_with_execution(df, question, api_key, data_source):
     # Get the appropriate prompt file based on data source
     prompt_file = get_prompt_file(data_source)
     
-    if not prompt_file:
+    if prompt_file:
+        # Read the prompt template from file
+        try:
+            with open(prompt_file, 'r') as file:
+                data_description = file.read().strip()
+        except FileNotFoundError:
+            st.error(f"{prompt_file} file not found!")
+            return None
+        except Exception as e:
+            st.error(f"Error reading {prompt_file}: {str(e)}")
+            return None
+    elif 'upload_prompt' in st.session_state:
+        # Uploaded files use the prompt generated for them at load time
+        data_description = st.session_state.upload_prompt
+    else:
         st.error("Unable to determine prompt file for the selected data source!")
         return None
 
-    # Read the prompt template from file
-    try:
-        with open(prompt_file, 'r') as file:
-            data_description = file.read().strip()
-    except FileNotFoundError:
-        st.error(f"{prompt_file} file not found!")
-        return None
-    except Exception as e:
-        st.error(f"Error reading {prompt_file}: {str(e)}")
-        return None
-
     
     headers = {
         "Content-Type": "application/json",
@@ -376,19 +384,196 @@ include any key variables that you calculated in the code inside {{}}.
 def load_data_file(filename):
     """Load a CSV data file with automatic parsing of date columns."""
     try:
-        # Load data without parsing dates first
-        data = pd.read_csv(filename)
+        # Read only the header to find the columns
+        columns = pd.read_csv(filename, nrows=0).columns
         
         # Identify columns with "date" in their name and parse them as dates
-        date_columns = [col for col in data.columns if 'date' in col.lower()]
+        date_columns = [col for col in columns if 'date' in col.lower()]
         
-        # Reload data with date parsing for identified columns
+        # Load data with date parsing for identified columns
         return pd.read_csv(filename, parse_dates=date_columns, dayfirst=True)
         
     except Exception as e:
         st.error(f"Error loading {filename}: {str(e)}")
         return None    
 
+
+# Upload ingestion settings. The parse cap bounds the chunks of a single file;
+# the registry cap bounds the parsed frames shared across sessions. Neither
+# counts the transient copy made by pd.concat or each session's working copy.
+UPLOAD_SAMPLE_ROWS = 1000
+UPLOAD_CHUNK_ROWS = 50000
+UPLOAD_MEMORY_CAP_MB = 500
+UPLOAD_REGISTRY_CAP_MB = 1000
+
+
+@st.cache_resource
+def get_upload_registry():
+    """Return the registry of parsed uploads shared by all sessions, keyed by content hash."""
+    return {'lock': threading.Lock(), 'entries': OrderedDict(), 'parsing': {}}
+
+
+def infer_upload_schema(buffer):
+    """Infer column dtypes, numeric columns and date formats from a sample of the uploaded CSV."""
+    sample = pd.read_csv(buffer, nrows=UPLOAD_SAMPLE_ROWS)
+    buffer.seek(0)
+    
+    # Keep "date" columns only if every sampled value parses with one format
+    date_formats = {}
+    for col in sample.columns:
+        values = sample[col].dropna()
+        if 'date' not in col.lower() or values.empty or pd.api.types.is_numeric_dtype(values):
+            continue
+        date_format = guess_datetime_format(str(values.iloc[0]), dayfirst=True)
+        if date_format and pd.to_datetime(values, format=date_format, errors='coerce').notna().all():
+            date_formats[col] = date_format
+    
+    # Columns that are numeric in the sample are converted to numbers in every chunk
+    numeric_columns = [col for col in sample.columns
+                       if sample[col].notna().any()
+                       and pd.api.types.is_numeric_dtype(sample[col])
+                       and not pd.api.types.is_bool_dtype(sample[col])]
+    
+    # Read everything else as text so chunks can't disagree on the type
+    dtypes = {col: 'object' for col in sample.columns if col not in numeric_columns}
+    
+    return {'dtypes': dtypes, 'numeric_columns': numeric_columns, 'date_formats': date_formats}
+
+
+def read_upload_in_chunks(buffer, total_bytes, schema, progress_bar=None):
+    """Parse the uploaded CSV chunk by chunk into a typed dataframe, enforcing the memory cap.
+    
+    Values that don't match their column's sampled type are left empty, and the
+    number left empty per column is returned alongside the dataframe.
+    """
+    memory_cap = UPLOAD_MEMORY_CAP_MB * 1024 * 1024
+    memory_used = 0
+    chunks = []
+    coerced = {}
+    
+    with pd.read_csv(buffer, chunksize=UPLOAD_CHUNK_ROWS, dtype=schema['dtypes']) as reader:
+        for chunk in reader:
+            for col, date_format in schema['date_formats'].items():
+                parsed = pd.to_datetime(chunk[col], format=date_format, errors='coerce')
+                coerced[col] = coerced.get(col, 0) + int((chunk[col].notna() & parsed.isna()).sum())
+                chunk[col] = parsed
+            for col in schema['numeric_columns']:
+                if not pd.api.types.is_numeric_dtype(chunk[col]):
+                    parsed = pd.to_numeric(chunk[col], errors='coerce')
+                    coerced[col] = coerced.get(col, 0) + int((chunk[col].notna() & parsed.isna()).sum())
+                    chunk[col] = parsed
+            
+            memory_used += chunk.memory_usage(deep=True).sum()
+            if memory_used > memory_cap:
+                raise ValueError(f"File exceeds the {UPLOAD_MEMORY_CAP_MB} MB memory limit")
+            chunks.append(chunk)
+            
+            if progress_bar is not None:
+                fraction = min(buffer.tell() / max(total_bytes, 1), 1.0)
+                progress_bar.progress(fraction, text=f"Loaded {memory_used / 1024 / 1024:.1f} MB...")
+    
+    df = pd.concat(chunks, ignore_index=True)
+    if df.empty:
+        raise ValueError("Uploaded file contains no rows")
+    
+    return df, {col: count for col, count in coerced.items() if count}
+
+
+def generate_prompt(df, date_columns):
+    """Build the data description prompt for an uploaded dataframe."""
+    # Example row with dates in the same dd-mm-yyyy format as the bundled prompts
+    example_row = {}
+    for col in df.columns:
+        value = df[col].iloc[0]
+        if pd.isna(value):
+            value = None
+        elif col in date_columns:
+            value = value.strftime('%d-%m-%Y')
+        elif hasattr(value, 'item'):
+            value = value.item()
+        example_row[col] = value
+    example_json = json.dumps(example_row, indent=2, ensure_ascii=False, default=str)
+    
+    notes = []
+    for col in df.columns:
+        values = df[col].dropna()
+        if values.empty:
+            continue
+        if col in date_columns:
+            notes.append(f'- The "{col}" column ranges from {values.min().strftime("%b %Y")} '
+                         f'to {values.max().strftime("%b %Y")} and is in dd-mm-yyyy format')
+        elif not pd.api.types.is_numeric_dtype(values):
+            unique_values = values.unique()
+            if len(unique_values) <= 10:
+                quoted = ', '.join(f'"{value}"' for value in unique_values)
+                notes.append(f'- The "{col}" column includes {len(unique_values)} values: {quoted}')
+        else:
+            notes.append(f'- The "{col}" column is numeric and ranges from '
+                         f'{values.min()} to {values.max()}')
+    
+    return (
+        "Here is an example of what one row of the data looks like in json format "
+        "but I will provide you with first 5 rows of the dataframe inside <data> tags:\n"
+        f"{{{example_json}}}\n\n"
+        "<data>\n{{df.head().to_string()}}\n</data>\n\n"
+        "Some key things to note about the data:\n"
+        + '\n'.join(notes)
+    )
+
+
+def load_uploaded_file(uploaded_file, progress_bar=None):
+    """Load an uploaded CSV, reusing the parsed frame and prompt if the same content was seen before.
+    
+    Returns a working copy of the dataframe, its generated prompt and the number
+    of values per column that couldn't be parsed.
+    """
+    # Hash and parse the uploaded buffer in place rather than copying its bytes
+    with uploaded_file.getbuffer() as view:
+        content_hash = hashlib.sha256(view).hexdigest()
+        total_bytes = view.nbytes
+    uploaded_file.seek(0)
+    
+    registry = get_upload_registry()
+    entries = registry['entries']
+    
+    # The registry lock only guards lookups and inserts; parsing is serialised
+    # per file so duplicate uploads wait for the first parse instead of repeating it
+    with registry['lock']:
+        entry = entries.get(content_hash)
+        if entry is not None:
+            entries.move_to_end(content_hash)
+        else:
+            parse_lock = registry['parsing'].setdefault(content_hash, threading.Lock())
+    
+    if entry is None:
+        with parse_lock:
+            with registry['lock']:
+                entry = entries.get(content_hash)
+            
+            if entry is None:
+                try:
+                    schema = infer_upload_schema(uploaded_file)
+                    df, coerced = read_upload_in_chunks(uploaded_file, total_bytes, schema, progress_bar)
+                    entry = {
+                        'df': df,
+                        'prompt': generate_prompt(df, list(schema['date_formats'])),
+                        'coerced': coerced,
+                        'memory': df.memory_usage(deep=True).sum()
+                    }
+                    
+                    with registry['lock']:
+                        # Drop the least recently used uploads to keep the registry under its cap
+                        registry_cap = UPLOAD_REGISTRY_CAP_MB * 1024 * 1024
+                        while entries and sum(item['memory'] for item in entries.values()) + entry['memory'] > registry_cap:
+                            entries.popitem(last=False)
+                        entries[content_hash] = entry
+                finally:
+                    with registry['lock']:
+                        registry['parsing'].pop(content_hash, None)
+    
+    # Copy so generated analysis code can't modify the shared frame
+    return entry['df'].copy(), entry['prompt'], entry['coerced']
+
 def display_analysis_results(results):
     """Display the analysis results in a structured format."""
     if results['approach']:
@@ -504,8 +689,7 @@ def main():
         st.subheader("2. Data Source")
         data_source = st.radio(
             "Choose Data Source:",
-            # list(data_files.keys()) + ["Upload Custom File"],
-            list(data_files.keys()),
+            list(data_files.keys()) + ["Upload Custom File"],
             disabled=False,
             index=0
         )
@@ -524,19 +708,35 @@ def main():
         else:
             uploaded_file = st.file_uploader("Upload CSV file", type=['csv'])
             if uploaded_file:
-                try:
-                    temp_df = pd.read_csv(uploaded_file)
-
-                    # Identify columns with "date" in their name and parse those as dates
-                    date_columns = [col for col in temp_df.columns if 'date' in col.lower()]
-                    
-                    # Reload the data with date parsing for identified columns
-                    df = pd.read_csv(uploaded_file, parse_dates=date_columns, dayfirst=True)
-
+                # Only parse when a new file is uploaded, not on every rerun
+                if st.session_state.get('upload_file_id') != uploaded_file.file_id:
+                    # Drop the previous upload so a failed load can't fall back to it
+                    reset_app_state()
+                    progress_bar = st.progress(0.0, text="Loading custom file...")
+                    try:
+                        df, prompt, coerced = load_uploaded_file(uploaded_file, progress_bar)
+                        st.session_state.df = df
+                        st.session_state.upload_prompt = prompt
+                        st.session_state.upload_coerced = coerced
+                    except Exception as e:
+                        # Remember the failure so the same file isn't re-parsed on every rerun
+                        st.session_state.upload_error = str(e)
+                    finally:
+                        progress_bar.empty()
+                    # Only mark the file as handled once loading finished, so a
+                    # rerun that interrupts the parse starts it again
+                    st.session_state.upload_file_id = uploaded_file.file_id
+                
+                if 'upload_error' in st.session_state:
+                    st.error(f"Error loading custom file: {st.session_state.upload_error}")
+                elif 'df' in st.session_state:
                     st.success("Custom file loaded successfully!")
-                    st.session_state.df = df
-                except Exception as e:
-                    st.error(f"Error loading custom file: {str(e)}")
+                    if st.session_state.get('upload_coerced'):
+                        counts = ', '.join(f'"{col}" ({count})' for col, count in st.session_state.upload_coerced.items())
+                        st.warning(f"Some values didn't match their column type and were left empty: {counts}")
+            elif 'upload_file_id' in st.session_state:
+                # File was removed from the uploader
+                reset_app_state()
     
     # Main content area
     if not api_key:
@@ -552,7 +752,7 @@ def main():
     
     # Display sample data
     with st.expander("📊 View Sample Data"):
-        display_df = st.session_state.df.copy()
+        display_df = st.session_state.df.head().copy()
         
         # Identify and format all datetime columns
         date_columns = display_df.select_dtypes(include=['datetime64']).columns